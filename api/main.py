@@ -1,18 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
 from pathlib import Path
-import shutil
+import asyncio
+import fcntl
+import hashlib
+import json
+import re
 import sys
 import logging
-from typing import List
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 import os
+import cv2
 
 # Add parent directory to path to import preprocessing
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from preprocessing.face_processor import FaceProcessor
 
-app = FastAPI(title="Age Progression Timeline API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweep_partial_uploads()
+    warm_models()
+    yield
+
+app = FastAPI(title="Age Progression Timeline API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -23,8 +40,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize face processor
-face_processor = FaceProcessor()
+# Face processor is created per worker process at startup (see warm_models).
+# Processing runs in the thread pool; MediaPipe graphs aren't thread-safe,
+# so calls into it are serialised with face_processor_lock.
+face_processor: Optional[FaceProcessor] = None
+face_processor_lock = threading.Lock()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,38 +53,357 @@ logger = logging.getLogger(__name__)
 # Ensure data directories exist
 UPLOAD_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
+PARTIAL_DIR = UPLOAD_DIR / ".partial"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+
+# Process umask, used to give atomically written files normal permissions
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Per-upload size limit for chunked uploads (bytes)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 8 * 1024 ** 3))
+# Chunked uploads untouched for this long are considered abandoned (seconds)
+UPLOAD_TTL_SECONDS = int(os.environ.get("UPLOAD_TTL_SECONDS", 24 * 60 * 60))
+
+def warm_models():
+    """
+    Load and warm the face models once per worker, so the first request
+    doesn't pay for graph initialisation.
+    """
+    global face_processor
+    face_processor = FaceProcessor()
+    face_processor.warmup()
+    logger.info(f"Face models warmed in worker {os.getpid()}")
+
+def atomic_write(path: Path, data: bytes):
+    """
+    Write bytes via a temp file in the same directory and an atomic rename,
+    so concurrent readers never see a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # mkstemp creates 0600; use the mode a plain open() would give
+            os.fchmod(f.fileno(), 0o666 & ~UMASK)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def fsync_dir(path: Path):
+    """
+    fsync a directory so a rename inside it survives a crash.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+SHA256_PATTERN = r"^[0-9a-f]{64}$"
+
+class SyncItem(BaseModel):
+    name: str
+    sha256: str = Field(..., pattern=SHA256_PATTERN)
+
+class SyncRequest(BaseModel):
+    items: List[SyncItem]
+
+def raw_path(digest: str) -> Path:
+    """
+    Content-addressed storage path for an upload. The client filename is
+    never used; the image format is detected from the content when read.
+    """
+    return UPLOAD_DIR / digest
+
+def find_raw(digest: str) -> Optional[Path]:
+    """
+    Find a stored upload by content hash.
+    """
+    path = raw_path(digest)
+    return path if path.is_file() else None
+
+def processed_ref(digest: str) -> Optional[str]:
+    """
+    Name of the processed image for a content hash, if one exists.
+    """
+    name = f"processed_{digest}.jpg"
+    return name if (PROCESSED_DIR / name).exists() else None
+
+@app.post("/sync/")
+async def sync_images(request: SyncRequest):
+    """
+    Compare a client manifest of content hashes against stored uploads.
+    Returns the hashes the server lacks and processed-image references
+    for the ones it already has.
+    """
+    missing = []
+    processed: Dict[str, Optional[str]] = {}
+    for item in request.items:
+        if find_raw(item.sha256) is None:
+            missing.append(item.sha256)
+        else:
+            processed[item.sha256] = processed_ref(item.sha256)
+    return {"missing": missing, "processed": processed}
+
+def process_upload(file_path: Path, digest: str, filename: str) -> Optional[str]:
+    """
+    Run face processing on a stored upload. Blocking; call it from a
+    worker thread, not the event loop.
+    Returns the processed-image reference, or None if no face was found.
+    """
+    with face_processor_lock:
+        processed = face_processor.process_image(str(file_path))
+    if processed is None:
+        logger.warning(f"Failed to process {filename}")
+        return None
+    output_path = PROCESSED_DIR / f"processed_{digest}.jpg"
+    ok, encoded = cv2.imencode(".jpg", processed)
+    if not ok:
+        raise RuntimeError(f"Could not encode processed image for {filename}")
+    atomic_write(output_path, encoded.tobytes())
+    logger.info(f"Successfully processed {filename}")
+    return output_path.name
+
+async def store_upload(file: UploadFile) -> str:
+    """
+    Stream an uploaded file to a temp file in UPLOAD_DIR while hashing it,
+    then rename it to its content-addressed path. Memory use is one block
+    regardless of file size. Returns the content hash.
+    """
+    loop = asyncio.get_running_loop()
+    hasher = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), 0o666 & ~UMASK)
+            while block := await file.read(1024 * 1024):
+                hasher.update(block)
+                await loop.run_in_executor(None, f.write, block)
+            f.flush()
+            await loop.run_in_executor(None, os.fsync, f.fileno())
+        digest = hasher.hexdigest()
+        file_path = raw_path(digest)
+        if file_path.exists():
+            os.unlink(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+            await loop.run_in_executor(None, fsync_dir, UPLOAD_DIR)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return digest
 
 @app.post("/upload-images/")
 async def upload_images(files: List[UploadFile] = File(...)):
     """
     Upload multiple images for processing.
+    Uploads are stored by content hash; the response maps each hash to
+    its processed-image reference (None if no face was found).
     """
     try:
         saved_files = []
+        processed_refs: Dict[str, Optional[str]] = {}
         for file in files:
-            # Save uploaded file
-            file_path = UPLOAD_DIR / file.filename
-            with file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            # Save uploaded file under its content hash
+            digest = await store_upload(file)
+            file_path = raw_path(digest)
             saved_files.append(str(file_path))
             
             # Process the image
-            processed = face_processor.process_image(str(file_path))
-            if processed is not None:
-                output_path = PROCESSED_DIR / f"processed_{file.filename}"
-                cv2.imwrite(str(output_path), processed)
-                logger.info(f"Successfully processed {file.filename}")
-            else:
-                logger.warning(f"Failed to process {file.filename}")
+            processed_refs[digest] = await asyncio.get_running_loop().run_in_executor(
+                None, process_upload, file_path, digest, file.filename)
         
-        return {"message": f"Successfully uploaded and processed {len(saved_files)} images"}
+        return {
+            "message": f"Successfully uploaded and processed {len(saved_files)} images",
+            "processed": processed_refs
+        }
     
     except Exception as e:
         logger.error(f"Error processing uploads: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Chunked, resumable uploads ---
+# start -> PUT chunks at explicit offsets -> finalize. Bytes are streamed
+# straight from the request body into data/raw/.partial/<id>.part, so memory
+# use is constant regardless of file size. The part file on disk is the only
+# state: any worker can take the next chunk, and the content hash is computed
+# in a single pass at finalize.
+
+class UploadStart(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0)
+    sha256: Optional[str] = Field(None, pattern=SHA256_PATTERN)
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+def upload_paths(upload_id: str):
+    if not UPLOAD_ID_RE.match(upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    part_path = PARTIAL_DIR / f"{upload_id}.part"
+    meta_path = PARTIAL_DIR / f"{upload_id}.json"
+    if not meta_path.exists():
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return part_path, meta_path
+
+@asynccontextmanager
+async def upload_lock(upload_id: str):
+    """
+    Exclusive advisory lock on a chunked upload's part file, shared across
+    worker processes. The blocking flock call runs in a thread so the event
+    loop stays free.
+    """
+    part_path, _ = upload_paths(upload_id)
+    try:
+        fd = os.open(part_path, os.O_RDWR)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def upload_state(upload_id: str) -> dict:
+    """
+    Read the metadata and received byte count of a chunked upload from disk.
+    Callers must hold upload_lock.
+    """
+    part_path, meta_path = upload_paths(upload_id)
+    return {
+        "meta": json.loads(meta_path.read_text()),
+        "offset": part_path.stat().st_size,
+    }
+
+def hash_and_sync(path: Path) -> str:
+    """
+    SHA-256 of a file, read in blocks, then fsync it so the content is
+    durable before it is renamed into place.
+    """
+    hasher = hashlib.sha256()
+    with path.open("rb+") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+        os.fsync(f.fileno())
+    return hasher.hexdigest()
+
+def sweep_partial_uploads():
+    """
+    Delete chunked uploads that have not received data within the TTL,
+    plus leftover atomic-write temp files. Uploads locked by another
+    request are skipped.
+    """
+    cutoff = time.time() - UPLOAD_TTL_SECONDS
+    for meta_path in PARTIAL_DIR.glob("*.json"):
+        part_path = meta_path.with_suffix(".part")
+        try:
+            mtime = max(meta_path.stat().st_mtime, part_path.stat().st_mtime if part_path.exists() else 0)
+            if mtime >= cutoff:
+                continue
+            fd = os.open(part_path, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                meta_path.unlink()
+                part_path.unlink()
+            finally:
+                os.close(fd)
+            logger.info(f"Expired abandoned upload {meta_path.stem}")
+        except (BlockingIOError, FileNotFoundError):
+            continue
+    for directory in (PARTIAL_DIR, UPLOAD_DIR, PROCESSED_DIR):
+        for tmp_path in directory.glob(".*.tmp"):
+            try:
+                if tmp_path.stat().st_mtime < cutoff:
+                    tmp_path.unlink()
+            except FileNotFoundError:
+                continue
+    for part_path in PARTIAL_DIR.glob("*.part"):
+        # Part files whose metadata was never written or already removed
+        try:
+            if not part_path.with_suffix(".json").exists() and part_path.stat().st_mtime < cutoff:
+                part_path.unlink()
+        except FileNotFoundError:
+            continue
+
+@app.post("/uploads/")
+async def start_upload(request: UploadStart):
+    """
+    Start a chunked upload. Returns the upload id to PUT chunks against.
+    """
+    await asyncio.get_running_loop().run_in_executor(None, sweep_partial_uploads)
+    if request.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds limit of {MAX_UPLOAD_BYTES} bytes")
+    upload_id = uuid.uuid4().hex
+    (PARTIAL_DIR / f"{upload_id}.part").touch()
+    atomic_write(PARTIAL_DIR / f"{upload_id}.json", json.dumps(request.model_dump()).encode())
+    return {"upload_id": upload_id, "offset": 0, "max_bytes": MAX_UPLOAD_BYTES}
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """
+    Report how many bytes have been received, so a client can resume.
+    """
+    async with upload_lock(upload_id):
+        state = upload_state(upload_id)
+    return {"upload_id": upload_id, "offset": state["offset"], "size": state["meta"]["size"]}
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """
+    Append a chunk at the given offset. The offset must equal the number
+    of bytes already received; otherwise 409 is returned with the current
+    offset so the client can seek and retry.
+    """
+    async with upload_lock(upload_id):
+        state = upload_state(upload_id)
+        part_path, _ = upload_paths(upload_id)
+        if offset != state["offset"]:
+            raise HTTPException(status_code=409, detail={"offset": state["offset"]})
+        size = state["meta"]["size"]
+        loop = asyncio.get_running_loop()
+        with part_path.open("ab") as f:
+            async for block in request.stream():
+                if state["offset"] + len(block) > size:
+                    raise HTTPException(status_code=413, detail={"offset": state["offset"]})
+                await loop.run_in_executor(None, f.write, block)
+                state["offset"] += len(block)
+    return {"upload_id": upload_id, "offset": state["offset"]}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """
+    Verify a completed chunked upload, move it into place atomically and
+    process it.
+    """
+    async with upload_lock(upload_id):
+        state = upload_state(upload_id)
+        part_path, meta_path = upload_paths(upload_id)
+        meta = state["meta"]
+        if state["offset"] != meta["size"]:
+            raise HTTPException(status_code=409, detail={"offset": state["offset"]})
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, hash_and_sync, part_path)
+        if meta.get("sha256") and meta["sha256"] != digest:
+            raise HTTPException(status_code=422, detail="Checksum mismatch")
+        file_path = raw_path(digest)
+        os.chmod(part_path, 0o666 & ~UMASK)
+        os.replace(part_path, file_path)
+        await loop.run_in_executor(None, fsync_dir, UPLOAD_DIR)
+        meta_path.unlink()
+    try:
+        processed = await asyncio.get_running_loop().run_in_executor(
+            None, process_upload, file_path, digest, meta["filename"])
+    except Exception as e:
+        logger.error(f"Error processing upload {meta['filename']}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"sha256": digest, "processed": processed}
+
 @app.get("/processed-images/")
 async def list_processed_images():
     """
@@ -84,13 +423,17 @@ async def get_image(image_name: str):
     """
     try:
         image_path = PROCESSED_DIR / image_name
-        if not image_path.exists():
+        if image_name.startswith(".") or not image_path.is_file():
             raise HTTPException(status_code=404, detail="Image not found")
         return FileResponse(str(image_path))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # WEB_CONCURRENCY > 1 runs several worker processes, each with its own models
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers) 
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Pooled, concurrent client for the FastAPI backend.
+
+One requests.Session is shared across Streamlit reruns so connections are
+kept alive, processed images are fetched in parallel, and decoded images are
+held in an LRU cache keyed by name and bounded by decoded size. Processed-image
+names are derived from the content hash of the upload, so a cached entry never
+goes stale and no revalidation (ETag / If-None-Match) is needed.
+"""
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """
+    Thread-safe LRU cache of decoded images keyed by name, bounded by the
+    decoded size of the images it holds.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_nbytes(image: Image.Image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, name: str) -> Optional[Image.Image]:
+        with self._lock:
+            if name not in self._items:
+                return None
+            self._items.move_to_end(name)
+            return self._items[name]
+
+    def put(self, name: str, image: Image.Image):
+        size = self.image_nbytes(image)
+        with self._lock:
+            if name in self._items:
+                self.nbytes -= self.image_nbytes(self._items.pop(name))
+            if size > self.max_bytes:
+                # Caching it would evict everything else
+                return
+            self._items[name] = image
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= self.image_nbytes(evicted)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._items
+
+
+class BackendClient:
+    def __init__(self, base_url: str, timeout: float = 10.0, upload_timeout: float = 120.0,
+                 max_workers: int = 8, cache_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            base_url: Backend root URL, e.g. http://localhost:8000
+            timeout: Default per-call timeout in seconds
+            upload_timeout: Timeout for upload/processing calls in seconds
+            max_workers: Number of concurrent image fetches (also the pool size)
+            cache_bytes: Maximum decoded size of the images kept in memory
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.cache = ImageCache(cache_bytes)
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def sync(self, items: List[dict]) -> dict:
+        """
+        Send a manifest of {"name", "sha256"} items to /sync/.
+
+        Returns:
+            Dict with "missing" hashes and "processed" references
+        """
+        resp = self.session.post(self._url("/sync/"), json={"items": items}, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def upload_images(self, files: List[tuple]) -> requests.Response:
+        """
+        Upload (filename, bytes, content_type) tuples to /upload-images/.
+        """
+        multipart = [("files", f) for f in files]
+        return self.session.post(self._url("/upload-images/"), files=multipart, timeout=self.upload_timeout)
+
+    def upload_files(self, files: List[dict], chunked_threshold: int = 8 * 1024 * 1024,
+                     batch_bytes: int = 32 * 1024 * 1024) -> Dict[str, Optional[str]]:
+        """
+        Upload files the server is missing in as few round trips as possible.
+        Small files go in multipart batches of up to batch_bytes; files larger
+        than chunked_threshold use the resumable chunked API. Batches and
+        chunked uploads run concurrently on the client's thread pool.
+
+        Args:
+            files: Dicts with "name", "bytes", "type" and "sha256"
+            chunked_threshold: Size above which a file is uploaded in chunks
+            batch_bytes: Maximum payload of one multipart request
+
+        Returns:
+            Mapping of content hash to processed-image reference (None if
+            no face was found)
+        """
+        batches, batch, batch_size = [], [], 0
+        large = []
+        for f in files:
+            size = len(f["bytes"])
+            if size > chunked_threshold:
+                large.append(f)
+                continue
+            if batch and batch_size + size > batch_bytes:
+                batches.append(batch)
+                batch, batch_size = [], 0
+            batch.append((f["name"], f["bytes"], f["type"]))
+            batch_size += size
+        if batch:
+            batches.append(batch)
+
+        def send_batch(batch):
+            resp = self.upload_images(batch)
+            resp.raise_for_status()
+            return resp.json().get("processed", {})
+
+        def send_chunked(f):
+            result = self.upload_chunked(f["name"], f["bytes"], sha256=f["sha256"])
+            return {result["sha256"]: result["processed"]}
+
+        futures = [self.executor.submit(send_batch, b) for b in batches]
+        futures += [self.executor.submit(send_chunked, f) for f in large]
+        processed: Dict[str, Optional[str]] = {}
+        for future in futures:
+            processed.update(future.result())
+        return processed
+
+    def upload_chunked(self, name: str, data: Union[bytes, BinaryIO], sha256: Optional[str] = None,
+                       chunk_size: int = 8 * 1024 * 1024, max_retries: int = 5,
+                       backoff: float = 0.5) -> dict:
+        """
+        Upload one file through the chunked /uploads/ API, resuming from the
+        server's offset after a dropped connection.
+
+        Args:
+            name: Original filename (used for the stored suffix)
+            data: File contents, or a seekable binary file object
+            sha256: Expected content hash, checked by the server on finalize
+            chunk_size: Bytes sent per PUT
+            max_retries: Consecutive failures tolerated before giving up
+            backoff: Initial retry delay in seconds, doubled after each failure
+
+        Returns:
+            Finalize response with "sha256" and "processed"
+        """
+        f = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        size = f.seek(0, os.SEEK_END)
+        resp = self.session.post(self._url("/uploads/"), json={"filename": name, "size": size, "sha256": sha256},
+                                 timeout=self.timeout)
+        resp.raise_for_status()
+        upload_url = self._url(f"/uploads/{resp.json()['upload_id']}")
+
+        offset = 0
+        failures = 0
+        resync = False
+        while resync or offset < size:
+            try:
+                if resync:
+                    # Ask the server how much it actually has before resending
+                    status = self.session.get(upload_url, timeout=self.timeout)
+                    status.raise_for_status()
+                    offset = status.json()["offset"]
+                    resync = False
+                    continue
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                resp = self.session.put(upload_url, params={"offset": offset}, data=chunk, timeout=self.upload_timeout)
+                if resp.status_code == 409:
+                    offset = resp.json()["detail"]["offset"]
+                    continue
+                resp.raise_for_status()
+                offset = resp.json()["offset"]
+                failures = 0
+            except (requests.ConnectionError, requests.Timeout) as e:
+                failures += 1
+                if failures > max_retries:
+                    raise
+                delay = backoff * 2 ** (failures - 1)
+                logger.warning(f"Chunk upload of {name} interrupted at {offset}, resuming in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                resync = True
+
+        resp = self.session.post(f"{upload_url}/finalize", timeout=self.upload_timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def fetch_image(self, name: str) -> Optional[Image.Image]:
+        """
+        Fetch and decode a processed image, using the cache when possible.
+
+        Args:
+            name: Processed image name
+
+        Returns:
+            Decoded image, or None if it could not be fetched
+        """
+        cached = self.cache.get(name)
+        if cached is not None:
+            return cached
+        try:
+            resp = self.session.get(self._url(f"/image/{name}"), timeout=self.timeout)
+            resp.raise_for_status()
+            img = Image.open(io.BytesIO(resp.content))
+            img.load()
+        except Exception as e:
+            logger.warning(f"Could not fetch image {name}: {e}")
+            return None
+        self.cache.put(name, img)
+        return img
+
+    def fetch_images(self, names: Iterable[str]) -> Dict[str, Optional[Image.Image]]:
+        """
+        Fetch many processed images concurrently; cached ones cost no request.
+        """
+        names = list(dict.fromkeys(names))
+        results = {name: self.cache.get(name) for name in names}
+        pending = [name for name, img in results.items() if img is None]
+        for name, img in zip(pending, self.executor.map(self.fetch_image, pending)):
+            results[name] = img
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,118 @@
+"""
+Byte-budgeted image encoding.
+
+Instead of a fixed size and quality, each photo is encoded at the largest
+dimensions and highest quality that fit its share of a session byte budget.
+Quality is found by binary search on the encoded size; if even the lowest
+quality is too big, the image is scaled down and the search repeated.
+"""
+import io
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from PIL import Image
+
+FORMAT_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "AVIF": "image/avif"}
+MIME_EXTENSION = {"image/jpeg": ".jpg", "image/webp": ".webp", "image/avif": ".avif", "image/png": ".png"}
+
+
+@dataclass
+class EncodeResult:
+    data: bytes
+    size: Tuple[int, int]
+    quality: int
+    format: str
+
+    @property
+    def mime(self) -> str:
+        return FORMAT_MIME[self.format]
+
+
+def available_formats() -> List[str]:
+    """
+    Output formats this Pillow build can write, JPEG first.
+    """
+    Image.init()
+    return [fmt for fmt in FORMAT_MIME if fmt in Image.SAVE]
+
+
+def sniff_mime(data: bytes, default: str = "image/jpeg") -> str:
+    """
+    MIME type of encoded image bytes, read from the header only.
+    """
+    try:
+        return Image.open(io.BytesIO(data)).get_format_mimetype() or default
+    except Exception:
+        return default
+
+
+def encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
+
+
+def encode_to_budget(img: Image.Image, max_bytes: int, fmt: str = "JPEG", max_dim: int = 2048,
+                     min_dim: int = 256, min_quality: int = 20, quality_floor: int = 60,
+                     max_quality: int = 90, scale_step: float = 0.75) -> EncodeResult:
+    """
+    Encode an image as large and as high-quality as fits in max_bytes.
+
+    Dimensions are searched first: a size is only accepted if it fits at
+    quality_floor or better, otherwise the image is scaled down. Qualities
+    below quality_floor (down to min_quality) are only tried at min_dim.
+
+    Args:
+        img: Source image
+        max_bytes: Byte budget for this image
+        fmt: Output format (see available_formats)
+        max_dim: Largest allowed dimension in pixels
+        min_dim: Smallest dimension the search will scale down to
+        min_quality: Lowest encoder quality tried, only at min_dim
+        quality_floor: Lowest quality accepted above min_dim
+        max_quality: Highest encoder quality tried
+        scale_step: Largest factor applied to the dimensions when a size
+            doesn't fit; smaller steps are taken when far over budget
+
+    Returns:
+        The best encoding within budget, or the smallest one tried if
+        nothing fits
+    """
+    img = img.convert("RGB")
+    dim = min(max_dim, max(img.size))
+    while True:
+        if max(img.size) > dim:
+            ratio = dim / max(img.size)
+            scaled = img.resize((max(1, int(img.size[0] * ratio)), max(1, int(img.size[1] * ratio))), Image.LANCZOS)
+        else:
+            scaled = img
+        at_min_dim = dim <= min_dim
+        lo = min_quality if at_min_dim else quality_floor
+
+        # Check the lowest acceptable quality first; if it doesn't fit, shrink
+        floor_data = encode(scaled, fmt, lo)
+        if len(floor_data) > max_bytes:
+            if at_min_dim:
+                return EncodeResult(floor_data, scaled.size, lo, fmt)
+            # Encoded size scales roughly with pixel count
+            step = min(scale_step, (max_bytes / len(floor_data)) ** 0.5)
+            dim = max(min_dim, int(dim * step))
+            continue
+
+        # Binary search for the highest quality within budget at this size
+        best = EncodeResult(floor_data, scaled.size, lo, fmt)
+        lo, hi = lo + 1, max_quality
+        while lo <= hi:
+            quality = (lo + hi) // 2
+            data = encode(scaled, fmt, quality)
+            if len(data) <= max_bytes:
+                best = EncodeResult(data, scaled.size, quality, fmt)
+                lo = quality + 1
+            else:
+                hi = quality - 1
+        return best
@@ -18,6 +18,15 @@ class FaceProcessor:
             min_detection_confidence=0.5
         )
 
+    def warmup(self):
+        """
+        Run both models once on a blank frame so graph initialisation happens
+        up front rather than on the first real image.
+        """
+        blank = np.zeros((256, 256, 3), dtype=np.uint8)
+        self.face_detection.process(blank)
+        self.face_mesh.process(blank)
+
     def process_image(self, image_path: str, output_size: Tuple[int, int] = (512, 512)) -> Optional[np.ndarray]:
         """
         Process an image to detect, align, and crop the face.
@@ -1,23 +1,82 @@
 import streamlit as st
-import requests
 from PIL import Image, UnidentifiedImageError
 import io
 import random
 import datetime
 import base64
+import hashlib
+import os
+import shutil
+import tempfile
 from io import BytesIO
 import zipfile
 import csv
 from PIL import ExifTags
 import pillow_heif
 from PIL import ImageDraw, ImageFont
+from backend_client import BackendClient
+from image_encoding import MIME_EXTENSION, available_formats, encode_to_budget, sniff_mime
+from timeline_archive import TimelineArchive, ArchiveError, make_thumbnail, write_archive
 pillow_heif.register_heif_opener()
+if hasattr(pillow_heif, "register_avif_opener"):
+    pillow_heif.register_avif_opener()
 
-# Utility function for image to base64 (needed for timeline rendering)
-def image_to_base64(img):
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode()
+# Photos restored from a timeline archive keep only their manifest entry;
+# full images and thumbnails are read by offset from the mmapped archive when needed
+def photo_bytes(file_dict):
+    if "bytes" in file_dict:
+        return file_dict["bytes"]
+    return st.session_state.timeline_archive.read_image(file_dict["archive_entry"])
+
+def photo_thumb(file_dict):
+    if file_dict.get("thumb"):
+        return file_dict["thumb"]
+    if "archive_entry" in file_dict:
+        return st.session_state.timeline_archive.read_thumbnail(file_dict["archive_entry"])
+    # Photos added before thumbnails were precomputed
+    file_dict["thumb"] = make_thumbnail(photo_bytes(file_dict))
+    return file_dict["thumb"]
+
+def photo_size(file_dict):
+    if "bytes" in file_dict:
+        return len(file_dict["bytes"])
+    return file_dict["archive_entry"].image_length
+
+def photo_type(file_dict):
+    if "type" not in file_dict:
+        file_dict["type"] = sniff_mime(photo_bytes(file_dict))
+    return file_dict["type"]
+
+# Images are inlined into the page as base64 data URIs, which costs 4 bytes per 3
+def inline_size(n):
+    return 4 * ((n + 2) // 3)
+
+# What a photo costs against the session budget: its stored bytes plus its inlined thumbnail
+def photo_cost(file_dict):
+    if not file_dict.get("thumb") and "archive_entry" in file_dict:
+        thumb_length = file_dict["archive_entry"].thumb_length
+    else:
+        thumb_length = len(photo_thumb(file_dict))
+    return photo_size(file_dict) + inline_size(thumb_length)
+
+# Timeline strip source: the precomputed JPEG thumbnail
+def thumbnail_src(file_dict):
+    return "data:image/jpeg;base64," + base64.b64encode(photo_thumb(file_dict)).decode()
+
+# Magnifier source: the encoded photo itself, or a capped JPEG if it's larger than the window needs
+MAGNIFIER_SIZE = 480
+# Budget held back for the one magnified image inlined per page render
+MAGNIFIER_RESERVE = 256 * 1024
+# Estimated inline cost of a new photo's thumbnail, taken off its encode budget
+THUMB_ALLOWANCE = 24 * 1024
+
+def magnifier_src(file_dict):
+    data = photo_bytes(file_dict)
+    if max(Image.open(io.BytesIO(data)).size) > MAGNIFIER_SIZE:
+        data, mime = make_thumbnail(data, MAGNIFIER_SIZE), "image/jpeg"
+    else:
+        mime = photo_type(file_dict)
+    return f"data:{mime};base64," + base64.b64encode(data).decode()
 
 st.set_page_config(page_title="Age Progression Timeline", layout="wide")
 
@@ -26,6 +85,15 @@ st.markdown('### User Info')
 user_birthday = st.date_input("Enter your birthday", min_value=datetime.date(1950, 1, 1), key="user_birthday")
 
 BACKEND_URL = "http://localhost:8000"
+# Upload formats the backend's OpenCV decoder can read
+BACKEND_FORMATS = ("JPEG", "WEBP")
+
+# One pooled client (and image cache) shared across reruns
+@st.cache_resource
+def get_backend_client():
+    return BackendClient(BACKEND_URL)
+
+backend = get_backend_client()
 
 st.title("Age Progression Timeline (Flexible Date Input)")
 
@@ -44,7 +112,7 @@ if photo_files:
         col1, col2 = st.columns([1, 2])
         with col1:
             try:
-                img = Image.open(io.BytesIO(file_dict["bytes"]))
+                img = Image.open(io.BytesIO(photo_thumb(file_dict)))
                 st.image(img, width=100)
             except UnidentifiedImageError:
                 st.warning(f"Could not open image: {file_dict['name']}")
@@ -54,12 +122,16 @@ if photo_files:
             # --- Rotate button ---
             if st.button("Rotate 90°", key=f"rotate_{i}_{file_dict['name']}"):
                 try:
-                    img = Image.open(io.BytesIO(file_dict["bytes"]))
-                    rotated_img = img.rotate(-90, expand=True)
-                    buf = io.BytesIO()
-                    rotated_img.save(buf, format="JPEG", quality=50, optimize=True)
-                    file_dict["bytes"] = buf.getvalue()
-                    st.session_state.photo_files[i]["bytes"] = buf.getvalue()
+                    original = photo_bytes(file_dict)
+                    rotated_img = Image.open(io.BytesIO(original)).rotate(-90, expand=True)
+                    # Re-encode within the photo's existing share of the budget (the format selector is below)
+                    result = encode_to_budget(rotated_img, len(original),
+                                              fmt=st.session_state.get("output_format", BACKEND_FORMATS[0]))
+                    st.session_state.photo_files[i]["bytes"] = result.data
+                    st.session_state.photo_files[i]["type"] = result.mime
+                    st.session_state.photo_files[i]["thumb"] = make_thumbnail(result.data)
+                    st.session_state.photo_files[i].pop("sha256", None)
+                    st.session_state.photo_files[i].pop("archive_entry", None)
                     st.rerun()
                 except Exception as e:
                     st.warning(f"Could not rotate image: {e}")
@@ -226,15 +298,14 @@ if photo_files:
     selected_file_dict = sorted_photo_dates[selected_idx]["file_dict"]
     selected_age = ages[selected_idx] if user_birthday else None
     try:
-        mag_img = Image.open(io.BytesIO(selected_file_dict["bytes"]))
-        mag_img_b64 = image_to_base64(mag_img)
+        mag_src = magnifier_src(selected_file_dict)
     except UnidentifiedImageError:
-        mag_img_b64 = ""
+        mag_src = ""
     age_html = f"<div style='text-align:center; font-size:20px; color:#444; margin-top:12px;'>Age {selected_age:.1f}</div>" if selected_age is not None else ""
     magnify_html = f'''
     <div style="display: flex; flex-direction: column; align-items: center; height: 340px;">
       <div style="width: 260px; height: 260px; border: 4px solid #222; border-radius: 24px; box-shadow: 0 8px 32px #aaa; background: #fff; display: flex; align-items: center; justify-content: center;">
-        <img src="data:image/png;base64,{mag_img_b64}" style="max-width: 240px; max-height: 240px; border-radius: 16px;">
+        <img src="{mag_src}" style="max-width: 240px; max-height: 240px; border-radius: 16px;">
       </div>
       {age_html}
     </div>
@@ -253,10 +324,9 @@ if photo_files:
         else:
             label = f"{date.year}-{pd['month']:02d}-{pd['day']:02d}"
         try:
-            img = Image.open(io.BytesIO(file_dict["bytes"]))
-            img_b64 = image_to_base64(img)
+            img_src = thumbnail_src(file_dict)
         except UnidentifiedImageError:
-            img_b64 = ""
+            img_src = ""
         # Magnify the selected photo
         if i == selected_idx:
             img_style = "width:160px; border-radius:16px; box-shadow:0 4px 16px #aaa; z-index:2;"
@@ -267,7 +337,7 @@ if photo_files:
         # Show age under each photo if birthday is set
         age_str = f"<div style='font-size:12px; color:#888;'>{'Age %.1f' % ages[i] if ages[i] is not None else ''}</div>" if user_birthday else ""
         html += f"""<div style='text-align: center;'>
-            <img src='data:image/png;base64,{img_b64}' style='{img_style}'><br>
+            <img src='{img_src}' style='{img_style}'><br>
             <span style='{label_style}'>{label}</span>
             {age_str}
         </div>"""
@@ -324,7 +394,7 @@ if photo_files:
             x = x_positions[i] + 50
             # Paste photo (resize to img_size x img_size)
             try:
-                photo = Image.open(io.BytesIO(pd["file_dict"]["bytes"])).resize((img_size, img_size))
+                photo = Image.open(io.BytesIO(photo_thumb(pd["file_dict"]))).resize((img_size, img_size))
                 img.paste(photo, (x-img_size//2, y-img_size-20))
             except Exception:
                 pass
@@ -360,11 +430,12 @@ if photo_files:
                 # Ensure unique filename
                 count = label_counts.get(base, 0) + 1
                 label_counts[base] = count
+                ext = MIME_EXTENSION.get(photo_type(file_dict), ".jpg")
                 if count == 1:
-                    filename = f"{base}.jpg"
+                    filename = f"{base}{ext}"
                 else:
-                    filename = f"{base}_{count}.jpg"
-                zf.writestr(filename, file_dict["bytes"])
+                    filename = f"{base}_{count}{ext}"
+                zf.writestr(filename, photo_bytes(file_dict))
                 # For CSV, use the label as above
                 label = base
                 csv_rows.append((filename, label))
@@ -392,25 +463,64 @@ if photo_files:
             mime="application/zip"
         )
 
-    # --- 2. Send images to backend for processing ---
-    with st.spinner("Uploading and processing images..."):
-        files = [("files", (f["name"], f["bytes"], f["type"])) for f in photo_files]
-        try:
-            resp = requests.post(f"{BACKEND_URL}/upload-images/", files=files)
-            if resp.status_code == 200:
-                st.success("Images uploaded and processed!")
-            else:
-                st.warning(f"Backend error: {resp.text}")
-        except Exception as e:
-            st.error(f"Could not connect to backend: {e}")
+    # --- Export Timeline Archive (indexed, with thumbnails) ---
+    def export_timeline_archive(photo_dates):
+        archive_buffer = io.BytesIO()
+        photos = []
+        for pd in photo_dates:
+            file_dict = pd["file_dict"]
+            photos.append({
+                "name": file_dict["name"],
+                "bytes": photo_bytes(file_dict),
+                "thumb": photo_thumb(file_dict),
+                "year": pd["date"].year,
+                "month": pd["month"],
+                "day": pd["day"],
+                "month_specified": pd["month_specified"],
+                "day_specified": pd["day_specified"]
+            })
+        write_archive(photos, archive_buffer)
+        archive_buffer.seek(0)
+        return archive_buffer
 
-    # --- 3. Fetch processed images from backend ---
+    if st.button("Export Timeline Archive"):
+        archive_buffer = export_timeline_archive(photo_dates)
+        st.download_button(
+            label="Download Timeline Archive",
+            data=archive_buffer,
+            file_name="timeline.ftl",
+            mime="application/octet-stream"
+        )
+
+    # --- 2. Sync images with backend (only upload content it lacks) ---
+    for f in photo_files:
+        if "sha256" not in f:
+            f["sha256"] = hashlib.sha256(photo_bytes(f)).hexdigest()
+    processed_refs = {}
     try:
-        resp = requests.get(f"{BACKEND_URL}/processed-images/")
-        processed_names = resp.json().get("images", [])
+        manifest = [{"name": f["name"], "sha256": f["sha256"]} for f in photo_files]
+        sync = backend.sync(manifest)
+        processed_refs.update(sync.get("processed", {}))
+        missing = set(sync.get("missing", []))
+        if missing:
+            with st.spinner(f"Uploading and processing {len(missing)} new images..."):
+                uploads = {
+                    f["sha256"]: {"name": f["name"], "bytes": photo_bytes(f), "type": photo_type(f), "sha256": f["sha256"]}
+                    for f in photo_files if f["sha256"] in missing
+                }
+                processed_refs.update(backend.upload_files(list(uploads.values())))
+                st.success("Images uploaded and processed!")
     except Exception as e:
-        st.error(f"Could not fetch processed images: {e}")
-        processed_names = []
+        st.error(f"Could not sync with backend: {e}")
+
+    # --- 3. Collect processed image references for this session ---
+    processed_names = []
+    seen_refs = set()
+    for f in photo_files:
+        ref = processed_refs.get(f["sha256"])
+        if ref and ref not in seen_refs:
+            seen_refs.add(ref)
+            processed_names.append((ref, f["name"]))
 
     # --- 4. Estimate age for each image (placeholder logic) ---
     # In a real app, call an age estimation model here
@@ -423,8 +533,8 @@ if photo_files:
         return random.randint(5, 70)
 
     timeline = []
-    for name in processed_names:
-        age = fake_age_estimation(name)
+    for name, original_name in processed_names:
+        age = fake_age_estimation(original_name)
         timeline.append({"name": name, "age": age})
     # Sort by age
     timeline.sort(key=lambda x: x["age"])
@@ -438,37 +548,75 @@ if photo_files:
             format="Age %d"
         )
         selected = timeline[idx]
+        # Fetch all processed images concurrently (cached ones cost nothing)
+        processed_images = backend.fetch_images(t["name"] for t in timeline)
 
         # --- 6. Show dynamic headshot ---
         st.subheader(f"Dynamic Headshot (Age {selected['age']})")
-        img_url = f"{BACKEND_URL}/image/{selected['name']}"
-        try:
-            img_resp = requests.get(img_url)
-            img = Image.open(io.BytesIO(img_resp.content))
+        img = processed_images.get(selected["name"])
+        if img is not None:
             st.image(img, width=300)
-        except Exception as e:
-            st.warning(f"Could not load image: {e}")
+        else:
+            st.warning(f"Could not load image: {selected['name']}")
 
         # --- 7. Show timeline as thumbnails ---
         st.markdown("### Timeline")
         cols = st.columns(len(timeline))
         for i, t in enumerate(timeline):
             with cols[i]:
-                img_url = f"{BACKEND_URL}/image/{t['name']}"
-                try:
-                    img_resp = requests.get(img_url)
-                    img = Image.open(io.BytesIO(img_resp.content))
+                img = processed_images.get(t["name"])
+                if img is not None:
                     st.image(img, width=80)
                     st.caption(f"Age {t['age']}")
-                except:
+                else:
                     st.write("(no image)")
 else:
     st.info("Upload some images to get started!")
 
 # --- Import Timeline ZIP ---
 if not st.session_state.get("zip_imported"):
-    imported_zip = st.file_uploader("Import Timeline ZIP (to restore timeline)", type=["zip"], key="import_zip")
-    if imported_zip is not None:
+    imported_zip = st.file_uploader("Import Timeline ZIP or Archive (to restore timeline)", type=["zip", "ftl"], key="import_zip")
+    if imported_zip is not None and imported_zip.name.lower().endswith(".ftl"):
+        # Indexed archive: spool it to disk and mmap it; only the manifest is parsed here
+        with tempfile.NamedTemporaryFile(suffix=".ftl", delete=False) as tmp:
+            shutil.copyfileobj(imported_zip, tmp)
+        try:
+            archive = TimelineArchive.open(tmp.name)
+        except ArchiveError as e:
+            archive = None
+            st.error(f"Could not read timeline archive: {e}")
+        # The mapping outlives the directory entry on POSIX
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+        if archive is not None:
+            st.session_state.timeline_archive = archive
+            st.session_state.photo_files = []
+            for entry in archive.entries:
+                if not entry.month_specified:
+                    display_str = f"{entry.year}--"
+                elif not entry.day_specified:
+                    display_str = f"{entry.year}-{entry.month:02d}-"
+                else:
+                    display_str = f"{entry.year}-{entry.month:02d}-{entry.day:02d}"
+                st.session_state.photo_files.append({
+                    "name": entry.name,
+                    "archive_entry": entry,
+                    "sha256": entry.sha256.hex(),
+                    "imported": True,
+                    "date": datetime.date(entry.year, entry.month or 1, entry.day or 1),
+                    "display": display_str,
+                    "month_specified": entry.month_specified,
+                    "day_specified": entry.day_specified,
+                    "year": entry.year,
+                    "month": entry.month,
+                    "day": entry.day
+                })
+            st.success(f"Imported {len(st.session_state.photo_files)} images from timeline archive.")
+            st.session_state["zip_imported"] = True
+            st.rerun()
+    elif imported_zip is not None:
         with zipfile.ZipFile(imported_zip) as zf:
             # Try to find timeline.csv robustly (case-insensitive, any folder)
             csv_name = None
@@ -510,7 +658,8 @@ if not st.session_state.get("zip_imported"):
                         st.session_state.photo_files.append({
                             "name": filename,
                             "bytes": img_bytes,
-                            "type": "image/jpeg",
+                            "thumb": make_thumbnail(img_bytes),
+                            "type": sniff_mime(img_bytes),
                             "imported": True,  # mark as imported
                             "date": date,
                             "display": display_str,
@@ -532,23 +681,23 @@ uploaded_files = st.file_uploader(
     accept_multiple_files=True
 )
 
-def compress_image(file_bytes, max_dim=800, quality=50):
+# Compression settings: total session budget (kept under Streamlit's 200MB limit) and output format
+col_budget, col_format = st.columns(2)
+with col_budget:
+    session_budget_mb = st.number_input("Session size budget (MB)", min_value=1, max_value=190, value=180, key="session_budget_mb")
+with col_format:
+    # Only offer formats the OpenCV-based face-processing backend can decode (not AVIF)
+    output_format = st.selectbox("Compression format", options=[f for f in available_formats() if f in BACKEND_FORMATS],
+                                 key="output_format", help="WEBP gives smaller files at the same quality.")
+
+def compress_image(file_bytes, max_bytes, fmt="JPEG"):
     try:
         img = Image.open(io.BytesIO(file_bytes))
-        # Resize if very large
-        if max(img.size) > max_dim:
-            ratio = max_dim / max(img.size)
-            new_size = (int(img.size[0]*ratio), int(img.size[1]*ratio))
-            img = img.resize(new_size, Image.LANCZOS)
-        else:
-            new_size = img.size
-        buf = io.BytesIO()
-        img = img.convert("RGB")
-        img.save(buf, format="JPEG", quality=quality, optimize=True)
-        return buf.getvalue(), new_size
+        result = encode_to_budget(img, max_bytes, fmt=fmt)
+        return result.data, result.size, result.mime, result.quality
     except Exception as e:
         st.warning(f"Could not compress image: {e}")
-        return file_bytes, None
+        return file_bytes, None, sniff_mime(file_bytes), None
 
 def get_exif_date(file_bytes):
     try:
@@ -569,22 +718,37 @@ def get_exif_date(file_bytes):
         pass
     return None
 
-# Always compress on upload
+# Always compress on upload, splitting what is left of the session budget across the new photos
 if uploaded_files:
-    for file in uploaded_files:
-        if not any(f["name"] == file.name for f in st.session_state.photo_files):
-            file_bytes = file.getvalue()
-            compressed_bytes, new_size = compress_image(file_bytes)
-            exif_date = get_exif_date(file_bytes)
-            file_dict = {
-                "name": file.name,
-                "bytes": compressed_bytes,
-                "type": "image/jpeg"
-            }
-            if exif_date:
-                year, month, day = exif_date
-                file_dict["exif_year"] = year
-                file_dict["exif_month"] = month
-                file_dict["exif_day"] = day
-            st.info(f"Compressed {file.name} to {len(compressed_bytes)//1024} KB" + (f" (resized to {new_size[0]}x{new_size[1]})" if new_size else ""))
-            st.session_state.photo_files.append(file_dict) 
\ No newline at end of file
+    existing_names = {f["name"] for f in st.session_state.photo_files}
+    new_files = [file for file in uploaded_files if file.name not in existing_names]
+    # The budget covers stored photos, their inlined thumbnails and the inlined magnifier image
+    remaining_bytes = (session_budget_mb * 1024 * 1024 - MAGNIFIER_RESERVE
+                       - sum(photo_cost(f) for f in st.session_state.photo_files))
+    new_bytes = 0
+    for n, file in enumerate(new_files):
+        file_bytes = file.getvalue()
+        per_image_budget = max(remaining_bytes, 0) // (len(new_files) - n)
+        compressed_bytes, new_size, mime, quality = compress_image(
+            file_bytes, max(per_image_budget - THUMB_ALLOWANCE, 0), output_format)
+        exif_date = get_exif_date(file_bytes)
+        file_dict = {
+            "name": file.name,
+            "bytes": compressed_bytes,
+            "thumb": make_thumbnail(compressed_bytes),
+            "type": mime
+        }
+        remaining_bytes -= photo_cost(file_dict)
+        new_bytes += len(compressed_bytes)
+        if exif_date:
+            year, month, day = exif_date
+            file_dict["exif_year"] = year
+            file_dict["exif_month"] = month
+            file_dict["exif_day"] = day
+        st.info(f"Compressed {file.name} to {len(compressed_bytes)//1024} KB" + (f" at {new_size[0]}x{new_size[1]}, quality {quality}" if new_size else ""))
+        st.session_state.photo_files.append(file_dict)
+    if new_files:
+        total_bytes = MAGNIFIER_RESERVE + sum(photo_cost(f) for f in st.session_state.photo_files)
+        st.info(f"Achieved {new_bytes // len(new_files) // 1024} KB per new image; session total {total_bytes / (1024 * 1024):.1f} MB of {session_budget_mb} MB budget")
+        if remaining_bytes < 0:
+            st.warning("Session budget exceeded even at minimum size and quality; consider removing photos.")
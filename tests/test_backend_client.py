@@ -0,0 +1,141 @@
+import hashlib
+import io
+import os
+
+import pytest
+import requests
+from PIL import Image
+
+from backend_client import BackendClient, ImageCache
+
+
+class FakeResponse:
+    def __init__(self, payload=None, status_code=200, content=b""):
+        self.payload = payload
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+class FakeUploadSession:
+    """
+    Stands in for the chunked upload API. The first `drops` chunks are
+    stored but their responses are lost, like a connection reset after
+    the server has read the body.
+    """
+
+    def __init__(self, drops=1):
+        self.received = bytearray()
+        self.drops = drops
+        self.calls = []
+
+    def post(self, url, json=None, timeout=None):
+        self.calls.append(("POST", url))
+        if url.endswith("/finalize"):
+            return FakeResponse({"sha256": hashlib.sha256(self.received).hexdigest(), "processed": None})
+        return FakeResponse({"upload_id": "u1", "offset": 0})
+
+    def put(self, url, params=None, data=None, timeout=None):
+        offset = params["offset"]
+        self.calls.append(("PUT", offset))
+        if offset != len(self.received):
+            return FakeResponse({"detail": {"offset": len(self.received)}}, status_code=409)
+        self.received += data
+        if self.drops:
+            self.drops -= 1
+            raise requests.ConnectionError("connection reset")
+        return FakeResponse({"offset": len(self.received)})
+
+    def get(self, url, timeout=None):
+        self.calls.append(("GET", url))
+        return FakeResponse({"offset": len(self.received)})
+
+    def close(self):
+        pass
+
+
+class FakeImageSession:
+    """
+    Serves a small PNG for any /image/ request and counts the requests.
+    """
+
+    def __init__(self):
+        buf = io.BytesIO()
+        Image.new("RGB", (8, 8), "red").save(buf, format="PNG")
+        self.png = buf.getvalue()
+        self.requested = []
+
+    def get(self, url, timeout=None):
+        self.requested.append(url.rsplit("/", 1)[-1])
+        return FakeResponse(content=self.png)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client():
+    client = BackendClient("http://backend")
+    yield client
+    client.close()
+
+
+def test_upload_chunked_resyncs_after_connection_error(client):
+    client.session = FakeUploadSession(drops=1)
+    data = os.urandom(10)
+    result = client.upload_chunked("a.jpg", data, chunk_size=4, backoff=0)
+
+    assert bytes(client.session.received) == data
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    # After the dropped response the client asks for the offset instead of resending the chunk
+    puts = [call[1] for call in client.session.calls if call[0] == "PUT"]
+    assert puts == [0, 4, 8]
+    assert ("GET", "http://backend/uploads/u1") in client.session.calls
+
+
+def test_upload_chunked_gives_up_after_max_retries(client):
+    client.session = FakeUploadSession(drops=100)
+    with pytest.raises(requests.ConnectionError):
+        client.upload_chunked("a.jpg", os.urandom(64), chunk_size=4, max_retries=2, backoff=0)
+
+
+def test_image_cache_evicts_least_recently_used():
+    # Each 10x10 RGB image is 300 decoded bytes
+    cache = ImageCache(max_bytes=900)
+    for name in "abc":
+        cache.put(name, Image.new("RGB", (10, 10)))
+    assert cache.get("a") is not None
+    cache.put("d", Image.new("RGB", (10, 10)))
+    assert "b" not in cache
+    assert all(name in cache for name in "acd")
+    assert cache.nbytes == 900
+
+
+def test_image_cache_bounded_by_decoded_size():
+    cache = ImageCache(max_bytes=950)
+    cache.put("small", Image.new("L", (10, 10)))
+    cache.put("large", Image.new("RGBA", (15, 15)))
+    assert "small" not in cache and "large" in cache
+    assert cache.nbytes == 900
+    # Larger than the whole cache: not kept, nothing else evicted
+    cache.put("huge", Image.new("RGB", (20, 20)))
+    assert "huge" not in cache and "large" in cache
+    cache.put("large", Image.new("L", (10, 10)))
+    assert cache.nbytes == 100 and len(cache) == 1
+
+
+def test_fetch_images_skips_requests_for_cached_images(client):
+    client.session = FakeImageSession()
+    first = client.fetch_images(["a", "b", "a"])
+    assert sorted(client.session.requested) == ["a", "b"]
+    assert all(img.size == (8, 8) for img in first.values())
+
+    second = client.fetch_images(["a", "b", "c"])
+    assert sorted(client.session.requested) == ["a", "b", "c"]
+    assert second["a"] is first["a"] and second["b"] is first["b"]
@@ -0,0 +1,49 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_encoding import available_formats, encode_to_budget, sniff_mime
+
+
+@pytest.fixture(scope="module")
+def photo():
+    # Gradient plus noise: compresses roughly like a real photo
+    gradient = Image.linear_gradient("L").resize((4000, 3000)).convert("RGB")
+    noise = Image.effect_noise((4000, 3000), 40).convert("RGB")
+    return Image.blend(gradient, noise, 0.5)
+
+
+@pytest.mark.parametrize("fmt", [f for f in available_formats() if f in ("JPEG", "WEBP")])
+@pytest.mark.parametrize("budget", [2_000_000, 300_000, 50_000])
+def test_stays_within_budget(photo, fmt, budget):
+    result = encode_to_budget(photo, budget, fmt=fmt)
+    assert len(result.data) <= budget
+    assert sniff_mime(result.data) == result.mime
+    assert Image.open(io.BytesIO(result.data)).size == result.size
+
+
+def test_shrinks_before_dropping_below_quality_floor(photo):
+    result = encode_to_budget(photo, 300_000, quality_floor=60)
+    assert len(result.data) <= 300_000
+    assert result.quality >= 60
+    assert max(result.size) < 2048
+
+
+def test_larger_budget_gives_larger_image(photo):
+    small = encode_to_budget(photo, 50_000)
+    large = encode_to_budget(photo, 1_000_000)
+    assert max(large.size) > max(small.size)
+
+
+def test_small_image_is_not_upscaled():
+    img = Image.new("RGB", (300, 200), "red")
+    result = encode_to_budget(img, 1_000_000)
+    assert result.size == (300, 200)
+    assert result.quality == 90
+
+
+def test_impossible_budget_returns_smallest_attempt(photo):
+    result = encode_to_budget(photo, 10, min_dim=256, min_quality=20)
+    assert max(result.size) == 256
+    assert result.quality == 20
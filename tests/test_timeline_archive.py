@@ -0,0 +1,80 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+from timeline_archive import ArchiveError, TimelineArchive, write_archive
+
+
+def make_jpeg(color, size=(400, 300)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def photos():
+    return [
+        {"name": "a.jpg", "bytes": make_jpeg("red"), "year": 2001, "month": None, "day": None,
+         "month_specified": False, "day_specified": False},
+        {"name": "bé.jpg", "bytes": make_jpeg("blue"), "year": 2005, "month": 3, "day": 9,
+         "month_specified": True, "day_specified": True},
+    ]
+
+
+def archive_bytes(photos):
+    buf = io.BytesIO()
+    write_archive(photos, buf)
+    return buf.getvalue()
+
+
+def test_round_trip_from_file(tmp_path, photos):
+    path = tmp_path / "timeline.ftl"
+    path.write_bytes(archive_bytes(photos))
+    with TimelineArchive.open(path) as archive:
+        assert [e.name for e in archive.entries] == ["a.jpg", "bé.jpg"]
+        first, second = archive.entries
+        assert (first.year, first.month, first.day, first.month_specified) == (2001, None, None, False)
+        assert (second.year, second.month, second.day, second.day_specified) == (2005, 3, 9, True)
+        assert archive.read_image(second, verify=True) == photos[1]["bytes"]
+        thumb = Image.open(io.BytesIO(archive.read_thumbnail(first)))
+        assert max(thumb.size) == 160
+
+
+@pytest.mark.parametrize("length", [0, 10, 20, 30, 60])
+def test_truncated_archive_raises_archive_error(photos, length):
+    with pytest.raises(ArchiveError):
+        TimelineArchive(archive_bytes(photos)[:length])
+
+
+def test_empty_file_raises_archive_error(tmp_path):
+    path = tmp_path / "empty.ftl"
+    path.write_bytes(b"")
+    with pytest.raises(ArchiveError):
+        TimelineArchive.open(path)
+
+
+def test_corrupt_name_raises_archive_error(photos):
+    data = bytearray(archive_bytes(photos))
+    # First name starts right after the header and the first fixed-size record
+    data[struct.calcsize("<4sHHIQ") + struct.calcsize("<HBBB32sQIQIH")] = 0xFF
+    with pytest.raises(ArchiveError):
+        TimelineArchive(bytes(data))
+
+
+def test_name_length_past_manifest_raises_archive_error(photos):
+    data = bytearray(archive_bytes(photos))
+    name_length_pos = struct.calcsize("<4sHHIQ") + struct.calcsize("<HBBB32sQIQIH") - 2
+    data[name_length_pos:name_length_pos + 2] = struct.pack("<H", 0xFFFF)
+    with pytest.raises(ArchiveError):
+        TimelineArchive(bytes(data))
+
+
+def test_checksum_mismatch_is_detected(photos):
+    data = bytearray(archive_bytes(photos))
+    archive = TimelineArchive(bytes(data))
+    entry = archive.entries[0]
+    data[entry.image_offset + 10] ^= 0xFF
+    with pytest.raises(ArchiveError):
+        TimelineArchive(bytes(data)).read_image(entry, verify=True)
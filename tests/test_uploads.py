@@ -0,0 +1,148 @@
+import fcntl
+import hashlib
+import importlib.util
+import os
+import sys
+import time
+import types
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+MAIN_PATH = Path(__file__).resolve().parent.parent / "api" / "main.py"
+
+
+class FakeFaceProcessor:
+    def warmup(self):
+        pass
+
+    def process_image(self, path):
+        return Path(path).read_bytes()
+
+
+class FakeEncoded(bytes):
+    def tobytes(self):
+        return bytes(self)
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    A fresh copy of api/main.py with its data directories under tmp_path
+    and the face model and OpenCV replaced by stand-ins.
+    """
+    monkeypatch.chdir(tmp_path)
+    face_processor = types.ModuleType("preprocessing.face_processor")
+    face_processor.FaceProcessor = FakeFaceProcessor
+    monkeypatch.setitem(sys.modules, "preprocessing", types.ModuleType("preprocessing"))
+    monkeypatch.setitem(sys.modules, "preprocessing.face_processor", face_processor)
+    monkeypatch.setitem(sys.modules, "cv2", types.SimpleNamespace(imencode=lambda ext, img: (True, FakeEncoded(img))))
+    spec = importlib.util.spec_from_file_location("upload_api_main", MAIN_PATH)
+    main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main)
+    return main
+
+
+@pytest.fixture
+def client(api):
+    with TestClient(api.app) as c:
+        yield c
+
+
+def start(client, data, sha256=None):
+    resp = client.post("/uploads/", json={"filename": "a.jpg", "size": len(data), "sha256": sha256})
+    assert resp.status_code == 200
+    return resp.json()["upload_id"]
+
+
+def test_chunked_upload_round_trip(api, client):
+    data = os.urandom(3000)
+    digest = hashlib.sha256(data).hexdigest()
+    upload_id = start(client, data, digest)
+    for offset in range(0, len(data), 1024):
+        resp = client.put(f"/uploads/{upload_id}", params={"offset": offset}, content=data[offset:offset + 1024])
+        assert resp.json()["offset"] == min(offset + 1024, len(data))
+    resp = client.post(f"/uploads/{upload_id}/finalize")
+    assert resp.status_code == 200
+    assert resp.json() == {"sha256": digest, "processed": f"processed_{digest}.jpg"}
+    assert api.raw_path(digest).read_bytes() == data
+    assert (api.PROCESSED_DIR / f"processed_{digest}.jpg").read_bytes() == data
+    assert not list(api.PARTIAL_DIR.iterdir())
+    assert client.post("/sync/", json={"items": [{"name": "a.jpg", "sha256": digest}]}).json() == {
+        "missing": [], "processed": {digest: f"processed_{digest}.jpg"}}
+
+
+def test_wrong_offset_returns_server_offset(client):
+    data = os.urandom(2000)
+    upload_id = start(client, data)
+    client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=data[:1200])
+
+    # A client that lost the response resends from 0 and is told where to resume
+    resp = client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=data[:1200])
+    assert resp.status_code == 409
+    assert resp.json()["detail"] == {"offset": 1200}
+    assert client.get(f"/uploads/{upload_id}").json()["offset"] == 1200
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 409
+
+    resp = client.put(f"/uploads/{upload_id}", params={"offset": 1200}, content=data[1200:])
+    assert resp.json()["offset"] == 2000
+    assert client.post(f"/uploads/{upload_id}/finalize").json()["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_chunk_past_declared_size(client):
+    upload_id = start(client, b"0123456789")
+    resp = client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=b"0123456789X")
+    assert resp.status_code == 413
+    assert client.get(f"/uploads/{upload_id}").json()["offset"] == 0
+
+
+def test_upload_size_limits(api, client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 100)
+    assert client.post("/uploads/", json={"filename": "a.jpg", "size": 101}).status_code == 413
+    assert client.post("/uploads/", json={"filename": "a.jpg", "size": -1}).status_code == 422
+    assert client.post("/uploads/", json={"filename": "a.jpg", "size": 100}).status_code == 200
+
+
+def test_checksum_mismatch(api, client):
+    data = b"some image bytes"
+    upload_id = start(client, data, "0" * 64)
+    client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=data)
+    resp = client.post(f"/uploads/{upload_id}/finalize")
+    assert resp.status_code == 422
+    assert not api.raw_path(hashlib.sha256(data).hexdigest()).exists()
+
+
+def test_unknown_upload(client):
+    assert client.get("/uploads/" + "f" * 32).status_code == 404
+    assert client.get("/uploads/not-an-id").status_code == 404
+
+
+def test_sweep_expires_old_and_skips_locked(api, client):
+    old_id = start(client, b"old")
+    locked_id = start(client, b"locked")
+    stale = time.time() - api.UPLOAD_TTL_SECONDS - 60
+    for upload_id in (old_id, locked_id):
+        for suffix in (".json", ".part"):
+            os.utime(api.PARTIAL_DIR / f"{upload_id}{suffix}", (stale, stale))
+
+    fd = os.open(api.PARTIAL_DIR / f"{locked_id}.part", os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        api.sweep_partial_uploads()
+    finally:
+        os.close(fd)
+
+    assert client.get(f"/uploads/{old_id}").status_code == 404
+    assert not (api.PARTIAL_DIR / f"{old_id}.part").exists()
+    assert client.get(f"/uploads/{locked_id}").status_code == 200
+
+
+def test_multipart_upload_is_content_addressed(api, client):
+    data = os.urandom(5000)
+    digest = hashlib.sha256(data).hexdigest()
+    for _ in range(2):
+        resp = client.post("/upload-images/", files=[("files", ("a.jpg", data, "image/jpeg"))])
+        assert resp.json()["processed"] == {digest: f"processed_{digest}.jpg"}
+    assert api.raw_path(digest).read_bytes() == data
+    assert not list(api.UPLOAD_DIR.glob(".*.tmp"))
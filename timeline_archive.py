@@ -0,0 +1,233 @@
+"""
+Indexed, random-access timeline archive (.ftl).
+
+Layout (all integers little-endian):
+
+    header    magic "FTLA", version, reserved, entry count, data offset
+    manifest  one fixed-size record per photo followed by its UTF-8 name
+    data      packed full images and precomputed thumbnails
+
+Every record carries the photo's date, granularity flags, SHA-256 and the
+absolute offsets/lengths of its image and thumbnail, so a reader only has to
+parse the manifest up front and can slice any photo out of an mmap on demand.
+The ZIP export in streamlit_app.py stays the interchange format.
+"""
+import datetime
+import hashlib
+import io
+import mmap
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Union
+
+from PIL import Image
+
+MAGIC = b"FTLA"
+VERSION = 1
+THUMBNAIL_SIZE = 160
+
+_HEADER = struct.Struct("<4sHHIQ")
+_RECORD = struct.Struct("<HBBB32sQIQIH")
+
+FLAG_MONTH = 0x01
+FLAG_DAY = 0x02
+
+
+class ArchiveError(ValueError):
+    """Raised when a timeline archive is malformed or fails verification."""
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    year: int
+    month: Optional[int]
+    day: Optional[int]
+    month_specified: bool
+    day_specified: bool
+    sha256: bytes
+    image_offset: int
+    image_length: int
+    thumb_offset: int
+    thumb_length: int
+
+
+def make_thumbnail(image_bytes: bytes, size: int = THUMBNAIL_SIZE) -> bytes:
+    """
+    Build a small JPEG thumbnail for the timeline strip.
+
+    Args:
+        image_bytes: Encoded source image
+        size: Maximum thumbnail dimension in pixels
+
+    Returns:
+        Encoded JPEG thumbnail, or the original bytes if they can't be decoded
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.thumbnail((size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, format="JPEG", quality=70)
+        return buf.getvalue()
+    except Exception:
+        return image_bytes
+
+
+def write_archive(photos: List[dict], out: BinaryIO) -> None:
+    """
+    Write photos to an indexed timeline archive.
+
+    Args:
+        photos: Dicts with "name", "bytes", "year", "month", "day",
+            "month_specified", "day_specified" and optionally "thumb"
+        out: Writable binary stream
+    """
+    names = [p["name"].encode("utf-8") for p in photos]
+    thumbs = [p.get("thumb") or make_thumbnail(p["bytes"]) for p in photos]
+    data_offset = _HEADER.size + sum(_RECORD.size + len(n) for n in names)
+
+    records = []
+    offset = data_offset
+    for photo, name, thumb in zip(photos, names, thumbs):
+        image = photo["bytes"]
+        flags = (FLAG_MONTH if photo.get("month_specified") else 0) | (FLAG_DAY if photo.get("day_specified") else 0)
+        image_offset = offset
+        thumb_offset = image_offset + len(image)
+        offset = thumb_offset + len(thumb)
+        records.append(_RECORD.pack(
+            int(photo["year"]),
+            int(photo.get("month") or 0),
+            int(photo.get("day") or 0),
+            flags,
+            hashlib.sha256(image).digest(),
+            image_offset,
+            len(image),
+            thumb_offset,
+            len(thumb),
+            len(name),
+        ) + name)
+
+    out.write(_HEADER.pack(MAGIC, VERSION, 0, len(photos), data_offset))
+    for record in records:
+        out.write(record)
+    for photo, thumb in zip(photos, thumbs):
+        out.write(photo["bytes"])
+        out.write(thumb)
+
+
+class TimelineArchive:
+    """
+    Read-only view over a timeline archive.
+
+    Opening only parses the manifest; images and thumbnails are sliced out
+    of the backing buffer (an mmap for files on disk) when requested.
+    """
+
+    def __init__(self, buffer: Union[bytes, memoryview, mmap.mmap], owner=None):
+        self._view = memoryview(buffer)
+        self._owner = owner
+        try:
+            self.entries = self._read_manifest()
+        except BaseException:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "TimelineArchive":
+        with open(path, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # mmap refuses empty files
+                raise ArchiveError("Archive is empty")
+        return cls(mm, owner=mm)
+
+    def close(self):
+        self._view.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _read_manifest(self) -> List[ArchiveEntry]:
+        try:
+            return self._parse_manifest()
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ArchiveError(f"Corrupt manifest: {e}")
+
+    def _parse_manifest(self) -> List[ArchiveEntry]:
+        view = self._view
+        if len(view) < _HEADER.size:
+            raise ArchiveError("Archive is truncated")
+        magic, version, _, count, data_offset = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ArchiveError("Not a timeline archive")
+        if version != VERSION:
+            raise ArchiveError(f"Unsupported archive version: {version}")
+        if data_offset > len(view):
+            raise ArchiveError("Archive is truncated")
+
+        entries = []
+        pos = _HEADER.size
+        for _ in range(count):
+            if pos + _RECORD.size > data_offset:
+                raise ArchiveError("Manifest is truncated")
+            (year, month, day, flags, digest, image_offset, image_length,
+             thumb_offset, thumb_length, name_length) = _RECORD.unpack_from(view, pos)
+            pos += _RECORD.size
+            if pos + name_length > data_offset:
+                raise ArchiveError("Manifest is truncated")
+            name = bytes(view[pos:pos + name_length]).decode("utf-8")
+            pos += name_length
+            if max(image_offset + image_length, thumb_offset + thumb_length) > len(view):
+                raise ArchiveError(f"Data for {name} lies outside the archive")
+            month_specified = bool(flags & FLAG_MONTH)
+            day_specified = bool(flags & FLAG_DAY)
+            try:
+                datetime.date(year, month or 1, day or 1)
+            except ValueError:
+                raise ArchiveError(f"Invalid date for {name}")
+            if (month_specified and not month) or (day_specified and not (month_specified and day)):
+                raise ArchiveError(f"Invalid date granularity for {name}")
+            entries.append(ArchiveEntry(
+                name=name,
+                year=year,
+                month=month or None,
+                day=day or None,
+                month_specified=month_specified,
+                day_specified=day_specified,
+                sha256=digest,
+                image_offset=image_offset,
+                image_length=image_length,
+                thumb_offset=thumb_offset,
+                thumb_length=thumb_length,
+            ))
+        return entries
+
+    def read_image(self, entry: ArchiveEntry, verify: bool = False) -> bytes:
+        """
+        Read a full image by offset.
+
+        Args:
+            entry: Manifest entry to read
+            verify: Check the stored SHA-256 before returning
+
+        Returns:
+            Encoded image bytes
+        """
+        data = bytes(self._view[entry.image_offset:entry.image_offset + entry.image_length])
+        if verify and hashlib.sha256(data).digest() != entry.sha256:
+            raise ArchiveError(f"Checksum mismatch for {entry.name}")
+        return data
+
+    def read_thumbnail(self, entry: ArchiveEntry) -> bytes:
+        return bytes(self._view[entry.thumb_offset:entry.thumb_offset + entry.thumb_length])